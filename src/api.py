@@ -1,17 +1,30 @@
 import sys
 import os
+import time
 
 # Add src/ directory to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
 
 from src.pipeline import RAGPipeline
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import List
+# Imported from src/ directly, as pipeline.py imports them, so there is one copy of each module
+# (the reranker reads the same profiling state this app sets)
+from deadline import Deadline
+from profiling import Profiler
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Stop retrieval shard workers so they don't outlive the server
+    pipeline.close()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -25,33 +38,108 @@ app.add_middleware(
 # Initialize RAG pipeline
 pipeline = RAGPipeline()
 
+# On-demand profiling; disabled unless PROFILING_ADMIN_TOKEN is set
+profiler = Profiler()
+
+# Default /query time budget; parsed here so a bad QUERY_DEADLINE_MS fails at startup, not per request
+DEFAULT_DEADLINE_MS = Deadline.parse_ms(os.getenv("QUERY_DEADLINE_MS") or None)
+
+async def arrival_time() -> float:
+    """
+    Time the request reached the app. Async, so it runs on the event loop before a sync
+    handler waits for a threadpool worker; deadlines count that wait too.
+    """
+    return time.monotonic()
+
 # Define input schema for the API
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 5  # Optional; default to top 5 results
+    deadline_ms: Optional[int] = Field(None, gt=0)  # Optional time budget; defaults to QUERY_DEADLINE_MS if set
 
 # Define output schema for the API
 class QueryResponse(BaseModel):
     query: str
     summary: str  # Final summarized output from the pipeline
+    path: List[str]  # Stages taken, e.g. ["hybrid", "rerank", "gemini"] or degraded ["bm25_only", "fused_scores", "extractive"]
+
+# Input schema for arming profiling captures
+class ProfileRequest(BaseModel):
+    requests: int = 1  # Number of upcoming /query requests to profile
+    mode: str = "sample"  # "sample" (folded stacks) or "cprofile" (pstats)
+    torch: bool = False  # Also record PyTorch profiler traces of reranker forward passes
+
+def check_admin(token: Optional[str]):
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiler.authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
 @app.post("/query", response_model=QueryResponse)
-def query_rag(request: QueryRequest):
+def query_rag(
+    request: QueryRequest,
+    response: Response,
+    arrived_at: float = Depends(arrival_time),
+    x_profile: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+):
     """
     Query the RAG pipeline and return the final summarized response.
+    Send "X-Profile: sample|cprofile[,torch]" with a valid X-Admin-Token to profile this request;
+    the profile file names are returned in the X-Profile-Files response header.
     """
     query = request.query
     top_k = request.top_k
+    deadline_ms = request.deadline_ms if request.deadline_ms is not None else DEFAULT_DEADLINE_MS
+    deadline = Deadline.from_ms(deadline_ms, started_at=arrived_at)
 
     # Generate a placeholder query embedding (replace with actual embedding logic if needed)
     query_embedding = [0.1] * 384  # Replace with an actual query embedding
 
     # Run the pipeline
     print(f"Processing query: {query}")
-    summary = pipeline.run(query, query_embedding, top_k=top_k)
+    with profiler.capture("query", mode=x_profile, token=x_admin_token) as capture:
+        try:
+            result = pipeline.run(query, query_embedding, top_k=top_k, deadline=deadline)
+        except TimeoutError as e:
+            raise HTTPException(status_code=504, detail=f"Retrieval did not finish within the deadline: {e}")
+    if capture is not None:
+        response.headers["X-Profile-Files"] = ",".join(capture.files)
 
     # Return the final summarized response
     return {
         "query": query,
-        "summary": summary,
+        "summary": result["summary"],
+        "path": result["path"],
     }
+
+@app.post("/admin/profile")
+def arm_profiling(request: ProfileRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Profile the next N /query requests.
+    """
+    check_admin(x_admin_token)
+    try:
+        profiler.arm(request.requests, request.mode, request.torch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"pending": profiler.pending, "mode": profiler.mode, "torch": profiler.torch}
+
+@app.get("/admin/profiles")
+def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """
+    List captured profile files.
+    """
+    check_admin(x_admin_token)
+    return {"pending": profiler.pending, "files": profiler.list_files()}
+
+@app.get("/admin/profiles/{name}")
+def download_profile(name: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Download a profile file (.folded for flamegraph.pl/speedscope, .prof for snakeviz, .torch.json for Perfetto).
+    """
+    check_admin(x_admin_token)
+    path = profiler.file_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{name}' not found")
+    return FileResponse(path, filename=name)
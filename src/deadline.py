@@ -0,0 +1,57 @@
+import math
+import time
+
+
+class Deadline:
+    def __init__(self, timeout_seconds: float, started_at: float = None):
+        """
+        Per-request time budget shared by every pipeline stage.
+        :param timeout_seconds: Total budget.
+        :param started_at: time.monotonic() value the budget is measured from; defaults to now.
+        """
+        self.timeout_seconds = timeout_seconds
+        self.expires_at = (time.monotonic() if started_at is None else started_at) + timeout_seconds
+
+    @staticmethod
+    def parse_ms(timeout_ms):
+        """
+        Validate a millisecond budget given as a number or a numeric string (e.g. from the environment).
+        Returns the budget as a float, or None when no budget is given.
+        Raises ValueError for anything that isn't a finite positive number.
+        """
+        if timeout_ms is None:
+            return None
+        try:
+            value = float(timeout_ms)
+        except (TypeError, ValueError):
+            raise ValueError(f"Deadline must be a number of milliseconds, got {timeout_ms!r}")
+        if not math.isfinite(value) or value <= 0:
+            raise ValueError(f"Deadline must be positive, got {timeout_ms}ms")
+        return value
+
+    @classmethod
+    def from_ms(cls, timeout_ms, started_at: float = None):
+        """
+        Build a deadline from a millisecond budget. Returns None when no budget is given.
+        Raises ValueError for a budget that isn't positive.
+        :param started_at: time.monotonic() value the budget is measured from; defaults to now.
+        """
+        timeout_ms = cls.parse_ms(timeout_ms)
+        if timeout_ms is None:
+            return None
+        return cls(timeout_ms / 1000.0, started_at)
+
+    def remaining(self) -> float:
+        """
+        Seconds left before the deadline (never negative).
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def budget(self, reserve: float = 0.0) -> float:
+        """
+        Seconds a stage may spend while leaving `reserve` seconds for the stages after it.
+        """
+        return max(0.0, self.remaining() - reserve)
@@ -0,0 +1,197 @@
+import json
+import os
+import random
+import time
+
+import numpy as np
+from pydantic import BaseModel
+
+from sharding import top_k_indices
+
+
+class LatencyModel:
+    # Number of parameters each distribution takes
+    KINDS = {"none": 0, "fixed": 1, "uniform": 2, "lognormal": 2}
+
+    def __init__(self, spec: str = "none"):
+        """
+        Latency distribution for a fake backend, in milliseconds.
+        :param spec: "none", "fixed:MS", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA".
+        Raises ValueError for an unknown distribution or invalid parameters.
+        """
+        self.spec = spec or "none"
+        kind, _, args = self.spec.partition(":")
+        self.kind = kind
+
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        try:
+            self.args = [float(a) for a in args.split(",")] if args else []
+        except ValueError:
+            raise ValueError(f"Latency parameters must be numbers: {spec}")
+        if len(self.args) != self.KINDS[kind]:
+            raise ValueError(f"'{kind}' latency takes {self.KINDS[kind]} parameter(s), got {len(self.args)}: {spec}")
+        if any(a < 0 for a in self.args) or (kind == "lognormal" and self.args[0] <= 0):
+            raise ValueError(f"Latency parameters must be non-negative, with a positive lognormal median: {spec}")
+        if kind == "uniform" and self.args[0] > self.args[1]:
+            raise ValueError(f"Uniform latency needs LOW <= HIGH: {spec}")
+
+    def sample(self) -> float:
+        """
+        Draw one latency, in seconds.
+        """
+        if self.kind == "fixed":
+            ms = self.args[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(self.args[0], self.args[1])
+        elif self.kind == "lognormal":
+            ms = random.lognormvariate(np.log(self.args[0]), self.args[1])
+        else:
+            ms = 0.0
+        return ms / 1000.0
+
+    def wait(self, timeout: float = None) -> float:
+        """
+        Sleep for one sampled latency. Raises TimeoutError if it exceeds timeout (seconds).
+        """
+        latency = self.sample()
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake backend timed out after {timeout:.3f}s")
+        time.sleep(latency)
+        return latency
+
+
+class FakeHit:
+    def __init__(self, id, distance):
+        self.id = id
+        self.distance = distance
+
+
+class FakeConnections:
+    """
+    Stand-in for pymilvus.connections; connecting is a no-op.
+    """
+    def connect(self, alias="default", **kwargs):
+        print(f"[fake] Milvus connection '{alias}' opened in-process.")
+
+    def disconnect(self, alias="default"):
+        pass
+
+
+class FakeCollection:
+    """
+    In-process stand-in for pymilvus.Collection with exact L2 search over embeddings.json.
+    """
+    latency = LatencyModel()
+    embeddings_file = "./embeddings/embeddings.json"
+    _vectors = {}
+
+    def __init__(self, name, schema=None, **kwargs):
+        self.name = name
+        if name not in FakeCollection._vectors:
+            FakeCollection._vectors[name] = self._load_vectors()
+
+    def _load_vectors(self):
+        if not os.path.exists(self.embeddings_file):
+            return np.zeros((0, 0), dtype=np.float32)
+        with open(self.embeddings_file, "r") as f:
+            data = json.load(f)
+        return np.asarray([entry["embedding"] for entry in data], dtype=np.float32)
+
+    def load(self):
+        pass
+
+    def create_index(self, field_name, index_params):
+        pass
+
+    def insert(self, data):
+        chunk_ids, vectors = data
+        FakeCollection._vectors[self.name] = np.asarray(vectors, dtype=np.float32)
+
+    def search(self, data, anns_field, param, limit, timeout=None, **kwargs):
+        self.latency.wait(timeout)
+        vectors = FakeCollection._vectors[self.name]
+        results = []
+        for query_vector in data:
+            if vectors.size == 0:
+                results.append([])
+                continue
+            diff = vectors - np.asarray(query_vector, dtype=np.float32)
+            distances = np.einsum("ij,ij->i", diff, diff)
+            results.append([
+                FakeHit(i, float(distances[i])) for i in top_k_indices(distances, limit, descending=False)
+            ])
+        return results
+
+
+def _stub_for(schema):
+    """
+    Build a placeholder payload that validates against a pydantic model.
+    """
+    payload = {}
+    for name, field in schema.model_fields.items():
+        annotation = field.annotation
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            payload[name] = _stub_for(annotation)
+        else:
+            payload[name] = f"Fake {name.replace('_', ' ')}"
+    return payload
+
+
+class FakeResponse:
+    def __init__(self, text, parsed=None):
+        self.text = text
+        self.parsed = parsed
+
+
+class FakeModels:
+    def __init__(self, latency: LatencyModel, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def generate_content(self, model, contents, config=None):
+        timeout = None
+        if config and config.get("http_options", {}).get("timeout"):
+            timeout = config["http_options"]["timeout"] / 1000.0
+        self.latency.wait(timeout)
+
+        if random.random() < self.error_rate:
+            raise RuntimeError("Fake Gemini error (503 UNAVAILABLE)")
+
+        schema = (config or {}).get("response_schema")
+        if schema is not None:
+            payload = _stub_for(schema)
+            return FakeResponse(json.dumps(payload), schema.model_validate(payload))
+        return FakeResponse(f"Fake summary generated by {model}.")
+
+
+class FakeGenaiClient:
+    """
+    Stand-in for google.genai.Client with a configurable latency distribution and error rate.
+    """
+    latency = LatencyModel()
+    error_rate = 0.0
+
+    def __init__(self, api_key=None, **kwargs):
+        self.models = FakeModels(FakeGenaiClient.latency, FakeGenaiClient.error_rate)
+
+
+def install_fakes(milvus_latency=None, gemini_latency=None, gemini_error_rate=None):
+    """
+    Replace pymilvus and google.genai entry points with the in-process fakes.
+    Must run before retrieval, vector_db, summarization or the apps are imported.
+    Unset arguments are read from LOADTEST_MILVUS_LATENCY, LOADTEST_GEMINI_LATENCY
+    and LOADTEST_GEMINI_ERROR_RATE.
+    """
+    import pymilvus
+    from google import genai
+
+    FakeCollection.latency = LatencyModel(milvus_latency or os.getenv("LOADTEST_MILVUS_LATENCY", "none"))
+    FakeGenaiClient.latency = LatencyModel(gemini_latency or os.getenv("LOADTEST_GEMINI_LATENCY", "none"))
+    FakeGenaiClient.error_rate = float(gemini_error_rate or os.getenv("LOADTEST_GEMINI_ERROR_RATE") or 0.0)
+
+    pymilvus.connections = FakeConnections()
+    pymilvus.Collection = FakeCollection
+    genai.Client = FakeGenaiClient
+    os.environ.setdefault("GEMINI_API_KEY", "fake-gemini-key")
@@ -0,0 +1,455 @@
+import argparse
+import http.client
+import importlib.util
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # CPU/RSS reporting is skipped without psutil
+    psutil = None
+
+SRC_DIR = os.path.abspath(os.path.dirname(__file__))
+REPO_DIR = os.path.dirname(SRC_DIR)
+NOTES_DIR = os.path.join(REPO_DIR, "llm notes")
+
+sys.path.append(SRC_DIR)
+
+DEFAULT_QUERIES = [
+    "What documents are required for a health insurance claim?",
+    "How do I file a death claim for an individual policy?",
+    "What is covered under third party motor insurance?",
+    "What is the waiting period for the eShield Next policy?",
+    "Which documents are needed to claim after a road accident?",
+]
+
+DEFAULT_NOTES = [
+    "Customer called about a delayed death claim. Missing hospital certificate. Call back on Friday.",
+    "Caller wants to renew motor insurance and add roadside assistance. Send quote by email tomorrow.",
+    "Policyholder disputes premium increase. Escalated to underwriting, follow up next Monday.",
+]
+
+
+# --- Server side: app factories run inside each uvicorn worker ---
+
+def create_rag_app():
+    """
+    Build src/api.py's app against the fake Milvus collection and Gemini client.
+    """
+    from fakes import install_fakes
+    install_fakes()
+    sys.path.append(REPO_DIR)
+    from src.api import app
+    return app
+
+
+def create_notes_app():
+    """
+    Build "llm notes/main.py"'s app against the fake Gemini client.
+    """
+    from fakes import install_fakes
+    install_fakes()
+    spec = importlib.util.spec_from_file_location("llm_notes_main", os.path.join(NOTES_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+APPS = {
+    "rag": {"factory": "loadtest:create_rag_app", "path": "/query"},
+    "notes": {"factory": "loadtest:create_notes_app", "path": "/process_notes"},
+}
+
+
+def serve(app_name: str, port: int, workers: int):
+    import uvicorn
+    uvicorn.run(
+        APPS[app_name]["factory"], factory=True, host="127.0.0.1", port=port,
+        workers=workers, app_dir=SRC_DIR, log_level="warning",
+    )
+
+
+def prepare_workdir(app_name: str) -> str:
+    """
+    Working directory for the server. The RAG app reads ./embeddings/embeddings.json and
+    ./processed_chunks; if the checked-in embeddings are empty, random vectors are generated
+    for the existing chunks in a temporary directory.
+    """
+    if app_name == "notes":
+        return NOTES_DIR
+
+    embeddings_file = os.path.join(REPO_DIR, "embeddings", "embeddings.json")
+    if os.path.exists(embeddings_file) and os.path.getsize(embeddings_file) > 0:
+        return REPO_DIR
+
+    workdir = tempfile.mkdtemp(prefix="rag-loadtest-")
+    os.makedirs(os.path.join(workdir, "embeddings"))
+    os.symlink(os.path.join(REPO_DIR, "processed_chunks"), os.path.join(workdir, "processed_chunks"))
+
+    rng = random.Random(0)
+    chunks = sorted(f for f in os.listdir(os.path.join(REPO_DIR, "processed_chunks")) if f.endswith(".txt"))
+    data = [{"chunk_file": c, "embedding": [rng.uniform(-1, 1) for _ in range(384)]} for c in chunks]
+    with open(os.path.join(workdir, "embeddings", "embeddings.json"), "w") as f:
+        json.dump(data, f)
+    print(f"Generated synthetic embeddings for {len(data)} chunks in {workdir}")
+    return workdir
+
+
+def latency_spec(spec: str) -> str:
+    """
+    argparse type for the latency options, so a malformed spec fails before the server starts.
+    """
+    from fakes import LatencyModel
+    try:
+        LatencyModel(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return spec
+
+
+def start_server(args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["LOADTEST_MILVUS_LATENCY"] = args.milvus_latency
+    env["LOADTEST_GEMINI_LATENCY"] = args.gemini_latency
+    env["LOADTEST_GEMINI_ERROR_RATE"] = str(args.gemini_error_rate)
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--app", args.app,
+         "--port", str(args.port), "--workers", str(args.workers)],
+        cwd=prepare_workdir(args.app), env=env,
+    )
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with code {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=1)
+            conn.request("GET", "/openapi.json")
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            time.sleep(0.5)
+
+    server.terminate()
+    raise RuntimeError(f"Server did not start within {args.startup_timeout}s")
+
+
+# --- Client side: concurrency sweep ---
+
+def make_payloads(app_name: str, queries_file: str = None):
+    if queries_file:
+        with open(queries_file, "r") as f:
+            lines = [line.strip() for line in f if line.strip()]
+    else:
+        lines = DEFAULT_QUERIES if app_name == "rag" else DEFAULT_NOTES
+    key = "query" if app_name == "rag" else "text"
+    return [json.dumps({key: line}) for line in lines]
+
+
+def send_request(conn, path: str, body: str) -> bool:
+    """
+    POST one request. Returns True on a 2xx response without an "error" field.
+    """
+    conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    data = response.read()
+    if not 200 <= response.status < 300:
+        return False
+    try:
+        return "error" not in json.loads(data)
+    except ValueError:
+        return False
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class ResourceSampler:
+    def __init__(self, server: subprocess.Popen, num_workers: int, interval: float = 0.5):
+        """
+        Sample CPU and peak RSS of every server worker while a level runs.
+        A worker is one uvicorn worker process together with its descendants (e.g. shard process
+        pools). With a single worker, uvicorn serves from the server process itself.
+        """
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.peak_rss = {}
+        self.cpu_start = {}
+        self.cpu_latest = {}
+        if psutil is None:
+            return
+
+        parent = psutil.Process(server.pid)
+        if num_workers > 1:
+            self.workers = [child for child in parent.children() if self._is_uvicorn_worker(child)]
+        else:
+            self.workers = [parent]
+        self.started = time.monotonic()
+        self._sample(baseline=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _is_uvicorn_worker(process) -> bool:
+        """
+        uvicorn starts its workers through multiprocessing spawn; the resource tracker is spawned too.
+        """
+        try:
+            cmdline = " ".join(process.cmdline())
+        except psutil.Error:
+            return False
+        return "spawn_main" in cmdline and "resource_tracker" not in cmdline
+
+    def _sample(self, baseline: bool = False):
+        for worker in self.workers:
+            try:
+                members = [worker] + worker.children(recursive=True)
+            except psutil.Error:
+                continue
+            rss = 0
+            for process in members:
+                try:
+                    with process.oneshot():
+                        rss += process.memory_info().rss
+                        times = process.cpu_times()
+                except psutil.Error:
+                    continue
+                cpu = times.user + times.system
+                key = (worker.pid, process.pid)
+                if baseline:
+                    self.cpu_start[key] = cpu
+                else:
+                    self.cpu_start.setdefault(key, 0.0)  # Started during this level
+                self.cpu_latest[key] = cpu
+            self.peak_rss[worker.pid] = max(self.peak_rss.get(worker.pid, 0), rss)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        if psutil is None:
+            return []
+        self.stop_event.set()
+        self.thread.join()
+        self._sample()
+        wall = time.monotonic() - self.started
+
+        workers = []
+        for worker in self.workers:
+            cpu_seconds = sum(
+                self.cpu_latest[key] - self.cpu_start[key] for key in self.cpu_latest if key[0] == worker.pid
+            )
+            workers.append({
+                "pid": worker.pid,
+                "cpu_percent": round(cpu_seconds / wall * 100, 1) if wall else 0.0,
+                "peak_rss_mb": round(self.peak_rss.get(worker.pid, 0) / 2 ** 20, 1),
+            })
+        return workers
+
+
+def run_level(args, server, payloads, concurrency: int):
+    """
+    Drive the server with `concurrency` closed-loop clients for args.duration seconds.
+    """
+    path = APPS[args.app]["path"]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    def client(client_id):
+        conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=args.request_timeout)
+        n = client_id
+        while time.monotonic() < stop_at:
+            body = payloads[n % len(payloads)]
+            n += concurrency
+            started = time.monotonic()
+            try:
+                ok = send_request(conn, path, body)
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=args.request_timeout)
+            elapsed = time.monotonic() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+        conn.close()
+
+    sampler = ResourceSampler(server, args.workers)
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+    workers = sampler.stop()
+
+    latencies.sort()
+    total = len(latencies) + errors[0]
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "qps": round(len(latencies) / wall, 2),
+        "error_rate": round(errors[0] / total, 4) if total else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "workers": workers,
+    }
+
+
+def summarize_sweep(args, levels):
+    """
+    Find the saturation point and the pod count needed for the target QPS.
+    A level is within SLO if its p99 and error rate are under the limits.
+    Saturation is the first level whose QPS gain over the previous one is under 5%, or that breaks the SLO.
+    """
+    within_slo = [l for l in levels if l["p99_ms"] <= args.slo_ms and l["error_rate"] <= args.max_error_rate]
+    capacity_qps = max((l["qps"] for l in within_slo), default=0.0)
+
+    saturation = None
+    for previous, level in zip([None] + levels, levels):
+        breaks_slo = level not in within_slo
+        flat = previous is not None and level["qps"] < previous["qps"] * 1.05
+        if breaks_slo or flat:
+            saturation = level["concurrency"]
+            break
+
+    summary = {
+        "capacity_qps_per_pod": capacity_qps,
+        "saturation_concurrency": saturation,
+        "workers_per_pod": args.workers,
+        "slo_p99_ms": args.slo_ms,
+    }
+    if args.target_qps:
+        summary["pods_needed"] = math.ceil(args.target_qps / capacity_qps) if capacity_qps else None
+    return summary
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'conc':>5} {'reqs':>7} {'qps':>8} {'err%':>6} {'p50ms':>8} {'p90ms':>8} {'p99ms':>8}  workers (cpu%, peak rss MB)")
+    for l in report["levels"]:
+        workers = ", ".join(f"{w['cpu_percent']:.0f}%/{w['peak_rss_mb']:.0f}" for w in l["workers"]) or "n/a"
+        print(f"{l['concurrency']:>5} {l['requests']:>7} {l['qps']:>8.2f} {l['error_rate'] * 100:>6.2f} "
+              f"{l['p50_ms']:>8.1f} {l['p90_ms']:>8.1f} {l['p99_ms']:>8.1f}  {workers}")
+
+    summary = report["summary"]
+    print(f"\nCapacity within SLO (p99 <= {summary['slo_p99_ms']}ms): {summary['capacity_qps_per_pod']} QPS per pod "
+          f"({summary['workers_per_pod']} workers)")
+    print(f"Saturation at concurrency: {summary['saturation_concurrency'] or 'not reached'}")
+    if "pods_needed" in summary:
+        print(f"Pods needed for target: {summary['pods_needed']}")
+
+    if baseline:
+        before = baseline["summary"]["capacity_qps_per_pod"]
+        after = summary["capacity_qps_per_pod"]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"Baseline capacity: {before} QPS -> {after} QPS ({change}); "
+              f"saturation {baseline['summary']['saturation_concurrency']} -> {summary['saturation_concurrency']}")
+
+
+def run(args):
+    if psutil is None:
+        print("psutil is not installed; CPU/RSS per worker will not be reported.")
+
+    payloads = make_payloads(args.app, args.queries_file)
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    server = start_server(args)
+    try:
+        # Warm up model caches and connections before measuring
+        conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=args.request_timeout)
+        for body in payloads[:args.warmup]:
+            send_request(conn, APPS[args.app]["path"], body)
+        conn.close()
+
+        levels = []
+        for concurrency in concurrency_levels:
+            print(f"Running concurrency {concurrency} for {args.duration}s...")
+            levels.append(run_level(args, server, payloads, concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "app": args.app,
+        "config": {
+            "workers": args.workers,
+            "duration": args.duration,
+            "milvus_latency": args.milvus_latency,
+            "gemini_latency": args.gemini_latency,
+            "gemini_error_rate": args.gemini_error_rate,
+        },
+        "levels": levels,
+    }
+    report["summary"] = summarize_sweep(args, levels)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the FastAPI services against local Milvus and Gemini fakes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run an app against the fakes (used by 'run').")
+    serve_parser.add_argument("--app", choices=APPS, default="rag")
+    serve_parser.add_argument("--port", type=int, default=8600)
+    serve_parser.add_argument("--workers", type=int, default=1)
+
+    run_parser = subparsers.add_parser("run", help="Start an app and sweep concurrency levels.")
+    run_parser.add_argument("--app", choices=APPS, default="rag")
+    run_parser.add_argument("--port", type=int, default=8600)
+    run_parser.add_argument("--workers", type=int, default=1, help="Uvicorn workers per pod.")
+    run_parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Comma-separated client counts.")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="Seconds per concurrency level.")
+    run_parser.add_argument("--warmup", type=int, default=3, help="Requests sent before measuring.")
+    run_parser.add_argument("--milvus-latency", type=latency_spec, default="lognormal:20,0.3",
+                            help="none | fixed:MS | uniform:LOW,HIGH | lognormal:MEDIAN,SIGMA")
+    run_parser.add_argument("--gemini-latency", type=latency_spec, default="lognormal:800,0.4",
+                            help="Same format as --milvus-latency.")
+    run_parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    run_parser.add_argument("--queries-file", help="One query (or note) per line.")
+    run_parser.add_argument("--request-timeout", type=float, default=60.0)
+    run_parser.add_argument("--startup-timeout", type=float, default=300.0)
+    run_parser.add_argument("--slo-ms", type=float, default=3000.0, help="p99 latency SLO.")
+    run_parser.add_argument("--max-error-rate", type=float, default=0.01)
+    run_parser.add_argument("--target-qps", type=float, help="Peak QPS to size the deployment for.")
+    run_parser.add_argument("--output", help="Write the report as JSON.")
+    run_parser.add_argument("--baseline", help="Earlier JSON report to compare capacity against.")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.app, args.port, args.workers)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
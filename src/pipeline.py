@@ -7,40 +7,144 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
 from retrieval import HybridRetriever
 from reranking import Reranker
 from summarization import GeminiSummarizer
+from deadline import Deadline
+from profiling import torch_trace
 
 class RAGPipeline:
-    def __init__(self):
+    def __init__(self, summary_reserve_ms=None, summary_min_ms=None, fallback_margin_ms=None):
         """
         Initialize the RAG pipeline with retrieval, reranking, and summarization modules.
+        :param summary_reserve_ms: Time kept back for the Gemini call when budgeting the rerank stage
+                                   (env SUMMARY_RESERVE_MS, default 1500).
+        :param summary_min_ms: Below this much time for the Gemini call it is skipped for an extractive answer
+                               (env SUMMARY_MIN_MS, default 500).
+        :param fallback_margin_ms: Time kept back after the Gemini call so an extractive fallback still
+                                   lands within the deadline (env SUMMARY_FALLBACK_MARGIN_MS, default 100).
         """
         self.retriever = HybridRetriever()
         self.reranker = Reranker()
         self.summarizer = GeminiSummarizer()
+        self.summary_reserve = self._setting_ms(summary_reserve_ms, "SUMMARY_RESERVE_MS", 1500)
+        self.summary_min = self._setting_ms(summary_min_ms, "SUMMARY_MIN_MS", 500)
+        self.fallback_margin = self._setting_ms(fallback_margin_ms, "SUMMARY_FALLBACK_MARGIN_MS", 100)
 
-    def run(self, query: str, query_embedding: list, top_k: int = 5):
+    def close(self):
+        """
+        Release resources held by the pipeline stages (e.g. retrieval shard workers).
+        """
+        self.retriever.close()
+
+    @staticmethod
+    def _setting_ms(value, env_name: str, default: int) -> float:
+        """
+        Millisecond setting from the argument, else the environment, else the default; in seconds.
+        """
+        if value is None:
+            value = os.getenv(env_name) or default
+        return int(value) / 1000.0
+
+    def fuse_scores(self, retrieved_results, k: int = 60):
+        """
+        Reciprocal rank fusion of the BM25 and vector result lists.
+        :return: Mapping of chunk file to fused score.
+        """
+        fused = {}
+        for rank, r in enumerate(retrieved_results["bm25_results"]):
+            fused[r["chunk_file"]] = fused.get(r["chunk_file"], 0.0) + 1.0 / (k + rank + 1)
+        for rank, r in enumerate(retrieved_results["vector_results"]):
+            if 0 <= r["chunk_id"] < len(self.retriever.chunks):
+                chunk_file = self.retriever.chunks[r["chunk_id"]]
+                fused[chunk_file] = fused.get(chunk_file, 0.0) + 1.0 / (k + rank + 1)
+        return fused
+
+    def extractive_answer(self, results):
+        """
+        Fallback answer when there is no time left for Gemini: the top-ranked chunk, verbatim.
+        """
+        if not results:
+            return ""
+        return results[0]["text"].strip()
+
+    def _rerank_within(self, query: str, candidates, deadline):
+        """
+        Rerank as many candidates as the deadline allows, keeping time in reserve for summarization.
+        :return: (ordered candidates, path label)
+        """
+        if deadline is None:
+            return self.reranker.rerank(query, candidates), "rerank"
+
+        budget = deadline.budget(self.summary_reserve)
+        limit = self.reranker.max_candidates(budget)
+        if budget <= 0 or limit == 0:
+            return candidates, "fused_scores"
+        if limit < 0:
+            limit = len(candidates)  # No timing observed yet; rely on the in-loop deadline check
+
+        reranked = self.reranker.rerank(query, candidates[:limit], deadline=Deadline(budget))
+        reranked += candidates[limit:]
+
+        scored = sum(1 for r in reranked if "relevance_score" in r)
+        if scored == len(candidates):
+            return reranked, "rerank"
+        if scored == 0:
+            return reranked, "fused_scores"
+        return reranked, "partial_rerank"
+
+    def _summarize_within(self, query: str, results, deadline):
+        """
+        Summarize with Gemini, or fall back to an extractive answer if the deadline can't be met.
+        :return: (summary, path label)
+        """
+        if deadline is None:
+            return self.summarizer.summarize(results, query), "gemini"
+
+        # Leave a margin so the extractive fallback is still on time if Gemini times out
+        budget = deadline.budget(self.fallback_margin)
+        if budget < self.summary_min:
+            return self.extractive_answer(results), "extractive"
+
+        try:
+            return self.summarizer.summarize(results, query, timeout=budget), "gemini"
+        except Exception as e:
+            print(f"Summarization failed within deadline, using extractive answer: {e}")
+            return self.extractive_answer(results), "extractive"
+
+    def run(self, query: str, query_embedding: list, top_k: int = 5, deadline: Deadline = None):
         """
         Execute the full RAG pipeline: retrieve, rerank, and summarize.
+        With a deadline, stages degrade instead of overrunning it: drop the vector search, rerank fewer
+        candidates, skip reranking and keep the fused retrieval order, or answer with the top chunk instead
+        of Gemini. Raises TimeoutError if even BM25 retrieval can't finish in time.
         :param query: User query.
         :param query_embedding: Embedding of the query (for vector search).
         :param top_k: Number of top results to retrieve and rerank.
-        :return: Final summarized response.
+        :param deadline: Optional Deadline for the whole request.
+        :return: Dict with the final summarized response and the path taken through the stages.
         """
         print("Retrieving top candidates...")
-        retrieved_results = self.retriever.retrieve(query, query_embedding, top_k)
+        retrieved_results = self.retriever.retrieve(query, query_embedding, top_k, deadline=deadline)
+        fused_scores = self.fuse_scores(retrieved_results)
 
-        # Prepare candidates for reranking (e.g., get text for the chunks)
+        # Prepare candidates for reranking (e.g., get text for the chunks), best fused score first
         combined_results = [
-            {"chunk_file": r["chunk_file"], "text": self.retriever.read_chunk_text(r["chunk_file"])}
+            {
+                "chunk_file": r["chunk_file"],
+                "text": self.retriever.read_chunk_text(r["chunk_file"]),
+                "fused_score": fused_scores[r["chunk_file"]],
+            }
             for r in retrieved_results["bm25_results"]
         ]
+        combined_results.sort(key=lambda x: x["fused_score"], reverse=True)
 
         print("Reranking candidates...")
-        reranked_results = self.reranker.rerank(query, combined_results)
+        # Traced with the PyTorch profiler only when this request is being profiled
+        with torch_trace("rerank"):
+            reranked_results, rerank_path = self._rerank_within(query, combined_results, deadline)
 
         print("Summarizing results...")
-        summary = self.summarizer.summarize(reranked_results, query)
+        summary, summary_path = self._summarize_within(query, reranked_results, deadline)
 
-        return summary
+        return {"summary": summary, "path": [retrieved_results["mode"], rerank_path, summary_path]}
 
 
 # Example Usage
@@ -52,5 +156,5 @@ if __name__ == "__main__":
     query_embedding = [0.1] * 384  # Replace with actual embedding generation logic
 
     # Run the pipeline
-    summary = pipeline.run(query, query_embedding, top_k=5)
-    print("Final Summary:", summary)
+    result = pipeline.run(query, query_embedding, top_k=5)
+    print("Final Summary:", result["summary"])
@@ -0,0 +1,260 @@
+import cProfile
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+MODES = ("sample", "cprofile")
+
+# Capture active in the current request, seen by torch_trace() inside the reranker
+_current_capture: ContextVar = ContextVar("profile_capture", default=None)
+_capture_ids = itertools.count(1)
+
+
+# Worker threads that run part of a request elsewhere (see ShardedIndex); sampled alongside it
+HELPER_THREAD_PREFIXES = ("retrieval-shard",)
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Sample the Python stacks of one request thread, plus the retrieval shard pool threads,
+        at a fixed interval. Each stack is rooted at a "thread:<name>" frame. Output is in
+        folded-stack format ("frame;frame;frame count"), readable by flamegraph.pl, speedscope
+        and inferno.
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in threading.enumerate():
+                if thread.ident == self.thread_id:
+                    tag, helper = "request", False
+                elif thread.name.startswith(HELPER_THREAD_PREFIXES):
+                    tag, helper = thread.name, True
+                else:
+                    continue
+                frame = frames.get(thread.ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Idle pool threads wait in the executor; keep them only while searching a shard
+                if helper and not any("(sharding.py:" in entry for entry in stack):
+                    continue
+                if stack:
+                    stack.append(f"thread:{tag}")
+                    self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.counts.items():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileCapture:
+    def __init__(self, output_dir: str, label: str, mode: str, torch: bool):
+        """
+        One profiled request. Files written by the capture are listed in `files`.
+        """
+        self.output_dir = output_dir
+        self.prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{os.getpid()}-{next(_capture_ids)}"
+        self.mode = mode
+        self.torch = torch
+        self.files = []
+
+    def _path(self, suffix: str) -> str:
+        name = f"{self.prefix}{suffix}"
+        self.files.append(name)
+        return os.path.join(self.output_dir, name)
+
+    @contextmanager
+    def run(self):
+        token = _current_capture.set(self)
+        try:
+            if self.mode == "cprofile":
+                # cProfile only sees this thread; work on the shard pool threads shows up as waiting
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    yield self
+                finally:
+                    profile.disable()
+                    profile.dump_stats(self._path(".prof"))
+            else:
+                sampler = StackSampler(threading.get_ident())
+                sampler.start()
+                try:
+                    yield self
+                finally:
+                    sampler.stop()
+                    sampler.write(self._path(".folded"))
+        finally:
+            _current_capture.reset(token)
+
+    @contextmanager
+    def torch_profile(self, name: str):
+        """
+        Record a PyTorch profiler trace (Chrome trace plus folded CPU stacks).
+        """
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+
+        with profile(activities=activities, with_stack=True) as prof:
+            yield
+        prof.export_chrome_trace(self._path(f"-{name}.torch.json"))
+        prof.export_stacks(self._path(f"-{name}.torch.folded"), "self_cpu_time_total")
+
+
+class Profiler:
+    def __init__(self, output_dir=None, admin_token=None, max_files=None):
+        """
+        On-demand profiling for API requests. Disabled unless an admin token is configured.
+        :param output_dir: Where profile files are written (env PROFILE_OUTPUT_DIR, default ./profiles).
+        :param admin_token: Token required to arm or trigger captures (env PROFILING_ADMIN_TOKEN).
+        :param max_files: Profile files kept; the oldest are deleted after each capture
+                          (env PROFILE_MAX_FILES, default 100).
+        """
+        self.output_dir = os.path.abspath(output_dir or os.getenv("PROFILE_OUTPUT_DIR", "./profiles"))
+        self.admin_token = admin_token or os.getenv("PROFILING_ADMIN_TOKEN")
+        self.max_files = int(max_files or os.getenv("PROFILE_MAX_FILES") or 100)
+        self.pending = 0
+        self.mode = "sample"
+        self.torch = False
+        self._lock = threading.Lock()
+        self._active = threading.Lock()  # cProfile and the sampler support one capture at a time
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.admin_token)
+
+    def authorized(self, token) -> bool:
+        return self.enabled and token is not None and hmac.compare_digest(token, self.admin_token)
+
+    def arm(self, requests: int = 1, mode: str = "sample", torch: bool = False):
+        """
+        Profile the next `requests` requests.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}'. Use one of: {', '.join(MODES)}")
+        with self._lock:
+            self.pending = max(0, requests)
+            self.mode = mode
+            self.torch = torch
+
+    def _claim(self, mode=None, token=None):
+        """
+        Decide whether this request is captured. Returns (mode, torch) or None.
+        """
+        if mode is not None and self.authorized(token):
+            # Header value: "sample", "cprofile", optionally followed by ",torch"
+            options = [option.strip() for option in mode.split(",")]
+            requested = next((option for option in options if option in MODES), "sample")
+            return requested, "torch" in options
+        with self._lock:
+            if self.pending <= 0:
+                return None
+            self.pending -= 1
+            return self.mode, self.torch
+
+    def capture(self, label: str, mode=None, token=None):
+        """
+        Context manager profiling the enclosed block if a capture is armed or requested
+        through the X-Profile header. Yields the ProfileCapture, or None when not profiling.
+        """
+        if not self.pending and mode is None:
+            return nullcontext()  # Fast path: profiling disabled or not armed
+        return self._capture(label, mode, token)
+
+    @contextmanager
+    def _capture(self, label, mode, token):
+        if not self._active.acquire(blocking=False):
+            yield None  # Another request is being profiled
+            return
+        try:
+            claim = self._claim(mode, token)
+            if claim is None:
+                yield None
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            try:
+                with ProfileCapture(self.output_dir, label, *claim).run() as capture:
+                    yield capture
+            finally:
+                self._prune()
+        finally:
+            self._active.release()
+
+    def _prune(self):
+        """
+        Delete the oldest profile files beyond max_files.
+        """
+        # Other server workers may share the directory and prune it concurrently
+        files = []
+        for name in self.list_files():
+            path = os.path.join(self.output_dir, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        files.sort(reverse=True)
+        for _, path in files[self.max_files:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def list_files(self):
+        if not os.path.isdir(self.output_dir):
+            return []
+        return sorted(os.listdir(self.output_dir))
+
+    def file_path(self, name: str):
+        """
+        Absolute path of a profile file, or None if the name is unknown or escapes the output directory.
+        """
+        if os.path.basename(name) != name:
+            return None
+        path = os.path.join(self.output_dir, name)
+        return path if os.path.isfile(path) else None
+
+
+def torch_trace_active() -> bool:
+    """
+    True when the current request is being profiled with torch tracing, which slows the traced code down.
+    """
+    capture = _current_capture.get()
+    return capture is not None and capture.torch
+
+
+def torch_trace(name: str):
+    """
+    Record a PyTorch profiler trace around the block when the current request is being
+    profiled with torch tracing enabled; otherwise a no-op.
+    """
+    capture = _current_capture.get()
+    if capture is None or not capture.torch:
+        return nullcontext()
+    return capture.torch_profile(name)
@@ -1,7 +1,9 @@
 import logging
+import time
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 import torch
 from typing import List, Dict
+from profiling import torch_trace_active
 
 
 class Reranker:
@@ -17,22 +19,52 @@ class Reranker:
         self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
         self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
 
+        # Moving average of the time spent scoring one candidate, used to plan against deadlines
+        self.seconds_per_candidate = None
+
     def format_to_t5_query(self, query: str, candidate: str) -> str:
         """
         Format query-candidate pair for monoT5 input.
         """
         return f"Query: {query} Document: {candidate} Relevant:"
 
-    def rerank(self, query: str, candidates: List[Dict[str, str]]) -> List[Dict[str, float]]:
+    def max_candidates(self, budget_seconds: float) -> int:
+        """
+        Estimate how many candidates can be scored within a time budget.
+        Returns -1 when no timing has been observed yet.
+        """
+        if self.seconds_per_candidate is None:
+            return -1
+        return int(budget_seconds / self.seconds_per_candidate)
+
+    def _record_timing(self, elapsed: float):
+        if self.seconds_per_candidate is None:
+            self.seconds_per_candidate = elapsed
+        else:
+            self.seconds_per_candidate = 0.8 * self.seconds_per_candidate + 0.2 * elapsed
+
+    def rerank(self, query: str, candidates: List[Dict[str, str]], deadline=None) -> List[Dict[str, float]]:
         """
         Rerank candidates based on relevance to the query.
         :param query: The query text.
         :param candidates: A list of candidate documents (chunks).
+        :param deadline: Optional Deadline. Scoring stops once the next candidate would overrun it;
+                         unscored candidates are returned after the scored ones, in their given order,
+                         without a "relevance_score".
         :return: A list of candidates with relevance scores.
         """
         reranked_results = []
+        unscored = []
+        # Timings taken under the torch profiler are inflated; keep them out of the moving average
+        record_timings = not torch_trace_active()
+
+        for position, candidate in enumerate(candidates):
+            if deadline is not None and deadline.remaining() <= (self.seconds_per_candidate or 0.0):
+                self.logger.warning(f"Rerank deadline reached after {position} of {len(candidates)} candidates")
+                unscored = list(candidates[position:])
+                break
 
-        for candidate in candidates:
+            started = time.monotonic()
             try:
                 # Format input for monoT5
                 t5_input = self.format_to_t5_query(query, candidate["text"])
@@ -57,7 +89,9 @@ class Reranker:
             except Exception as e:
                 self.logger.error(f"Error processing candidate: {e}")
                 reranked_results.append({**candidate, "relevance_score": 0.5})  # Default to neutral score on error
+            if record_timings:
+                self._record_timing(time.monotonic() - started)
 
         # Sort candidates by relevance score
         reranked_results = sorted(reranked_results, key=lambda x: x["relevance_score"], reverse=True)
-        return reranked_results
+        return reranked_results + unscored
@@ -4,18 +4,52 @@ import os
 from dotenv import load_dotenv
 import json
 import numpy as np
+from sharding import RetrievalShard, ShardedIndex, assign_shards, top_k_indices
 
 
 # Load environment variables
 load_dotenv()
 
 class HybridRetriever:
-    def __init__(self, collection_name="document_embeddings"):
+    def __init__(self, collection_name="document_embeddings", num_shards=None, shard_assignment=None,
+                 shard_executor=None, max_workers=None):
         """
         Initialize Hybrid Retrieval with BM25 and Milvus vector search.
+        With num_shards > 1 the corpus is partitioned into shards, each with its own BM25 matrix
+        and local vector index, searched in parallel and merged. The BM25 top-k is identical to
+        unsharded mode. Vector search is exact L2 over the embeddings in embeddings.json, while
+        unsharded mode searches Milvus' approximate IVF_FLAT index (nprobe=10), so vector results
+        can differ where Milvus misses a true neighbour.
+        :param collection_name: Milvus collection used in unsharded mode.
+        :param num_shards: Number of shards (env RETRIEVAL_NUM_SHARDS, default 1 = unsharded).
+        :param shard_assignment: "round_robin", "hash" or a callable (env RETRIEVAL_SHARD_ASSIGNMENT).
+        :param shard_executor: "thread" or "process" (env RETRIEVAL_SHARD_EXECUTOR).
+        :param max_workers: Thread pool size for shard searches; defaults to one worker per shard.
+                            Not accepted with the process executor, which runs one worker per shard.
         """
         self.collection_name = collection_name
         self.vectorizer = TfidfVectorizer()  # BM25 approximation
+        self.num_shards = int(num_shards or os.getenv("RETRIEVAL_NUM_SHARDS") or 1)
+        self.shard_index = None
+
+        # Load chunk metadata for BM25
+        with open("./embeddings/embeddings.json", "r") as f:
+            self.chunk_metadata = json.load(f)
+        self.chunks = [metadata["chunk_file"] for metadata in self.chunk_metadata]
+
+        # Fit BM25 vectorizer on chunk text and keep the chunk matrix so queries don't re-read the corpus
+        print("Fitting BM25 vectorizer...")
+        chunk_texts = [self.read_chunk_text(chunk_file) for chunk_file in self.chunks]
+        self.chunk_vectors = self.vectorizer.fit_transform(chunk_texts)
+
+        if self.num_shards > 1:
+            self.shard_index = self._build_shards(
+                shard_assignment or os.getenv("RETRIEVAL_SHARD_ASSIGNMENT", "round_robin"),
+                shard_executor or os.getenv("RETRIEVAL_SHARD_EXECUTOR", "thread"),
+                max_workers,
+            )
+            self.chunk_vectors = None  # The shards hold the corpus from here on
+            return
 
         # Connect to Milvus
         uri = os.getenv("MILVUS_PUBLIC_ENDPOINT")
@@ -30,15 +64,39 @@ class HybridRetriever:
         # Check connection and load collection
         self.collection = self._load_collection()
 
-        # Load chunk metadata for BM25
-        with open("./embeddings/embeddings.json", "r") as f:
-            self.chunk_metadata = json.load(f)
-        self.chunks = [metadata["chunk_file"] for metadata in self.chunk_metadata]
-
-        # Fit BM25 vectorizer on chunk text
-        print("Fitting BM25 vectorizer...")
-        chunk_texts = [self.read_chunk_text(chunk_file) for chunk_file in self.chunks]
-        self.vectorizer.fit(chunk_texts)
+    def _build_shards(self, assignment, executor, max_workers):
+        """
+        Partition the chunk corpus into shards. IDF weights stay global (fitted on the whole corpus)
+        so BM25 scores are identical to the unsharded matrix. The shards' vector indexes are built
+        from embeddings.json, so every chunk there needs its "embedding".
+        """
+        print(f"Building {self.num_shards} retrieval shards ({assignment}, {executor} pool)...")
+        missing = [metadata["chunk_file"] for metadata in self.chunk_metadata if "embedding" not in metadata]
+        if missing:
+            raise ValueError(
+                f"Sharded retrieval needs embeddings in embeddings.json; {len(missing)} chunks have none "
+                f"(e.g. {missing[0]})"
+            )
+        shard_ids = np.asarray(assign_shards(self.chunks, self.num_shards, assignment))
+        embeddings = np.asarray([metadata["embedding"] for metadata in self.chunk_metadata], dtype=np.float32)
+
+        shards = []
+        for shard_id in range(self.num_shards):
+            positions = np.flatnonzero(shard_ids == shard_id)
+            shards.append(RetrievalShard(
+                shard_id,
+                positions,
+                self.chunk_vectors[positions],
+                embeddings[positions],
+            ))
+        return ShardedIndex(shards, executor=executor, max_workers=max_workers)
+
+    def close(self):
+        """
+        Stop the shard worker pools, if any.
+        """
+        if self.shard_index is not None:
+            self.shard_index.shutdown()
 
     def _load_collection(self):
         """
@@ -59,45 +117,75 @@ class HybridRetriever:
         """
         with open(f"./processed_chunks/{chunk_file}", "r") as f:
             return f.read()
-    def bm25_search(self, query, top_k=5):
+    def bm25_search(self, query, top_k=5, timeout=None):
         """
         Perform BM25 keyword-based retrieval.
+        :param timeout: Optional limit in seconds on waiting for the shards (sharded mode only).
         """
         query_vector = self.vectorizer.transform([query])
-        chunk_vectors = self.vectorizer.transform([self.read_chunk_text(c) for c in self.chunks])
+
+        if self.shard_index is not None:
+            return [
+                {"chunk_file": self.chunks[i], "bm25_score": score}
+                for score, i in self.shard_index.bm25_search(query_vector, top_k, timeout=timeout)
+            ]
 
         # Compute scores as dot product
-        scores = (chunk_vectors @ query_vector.T).toarray().flatten()
-        ranked_indices = np.argsort(scores)[::-1][:top_k]
-        return [{"chunk_file": self.chunks[i], "bm25_score": scores[i]} for i in ranked_indices]
+        scores = (self.chunk_vectors @ query_vector.T).toarray().flatten()
+        ranked_indices = top_k_indices(scores, top_k)
+        return [{"chunk_file": self.chunks[i], "bm25_score": float(scores[i])} for i in ranked_indices]
 
-    def vector_search(self, query_embedding, top_k=5):
+    def vector_search(self, query_embedding, top_k=5, timeout=None):
         """
-        Perform vector similarity search using Milvus.
+        Perform vector similarity search using Milvus, or the local shard indexes when sharded.
+        Chunk IDs are corpus positions, matching the IDs inserted by MilvusDB.insert_embeddings.
+        :param timeout: Optional limit in seconds on the search.
         """
+        if self.shard_index is not None:
+            return [
+                {"chunk_id": i, "distance": distance}
+                for distance, i in self.shard_index.vector_search(query_embedding, top_k, timeout=timeout)
+            ]
+
         search_params = {"nprobe": 10}
         results = self.collection.search(
             data=[query_embedding],
             anns_field="embedding",
             param=search_params,
             limit=top_k,
+            timeout=timeout,
         )
         return [{"chunk_id": result.id, "distance": result.distance} for result in results[0]]
 
-    def retrieve(self, query, query_embedding, top_k=5):
+    def retrieve(self, query, query_embedding, top_k=5, deadline=None):
         """
         Perform hybrid retrieval: BM25 + Vector Search.
+        With a deadline, both searches are bounded by the remaining time. BM25 raises TimeoutError
+        if it can't finish; the vector search is dropped instead, leaving BM25-only results.
+        :return: BM25 and vector results, and "mode" ("hybrid" or "bm25_only").
         """
         print("Performing BM25 search...")
-        bm25_results = self.bm25_search(query, top_k)
+        bm25_results = self.bm25_search(query, top_k, timeout=None if deadline is None else deadline.remaining())
 
         print("Performing vector similarity search...")
-        vector_results = self.vector_search(query_embedding, top_k)
+        mode = "hybrid"
+        if deadline is None:
+            vector_results = self.vector_search(query_embedding, top_k)
+        elif deadline.expired():
+            print("Deadline reached before vector search, using BM25 results only.")
+            vector_results, mode = [], "bm25_only"
+        else:
+            try:
+                vector_results = self.vector_search(query_embedding, top_k, timeout=deadline.remaining())
+            except Exception as e:
+                print(f"Vector search failed within deadline, using BM25 results only: {e}")
+                vector_results, mode = [], "bm25_only"
 
         # Combine results (you can customize this combination logic)
         combined_results = {
             "bm25_results": bm25_results,
             "vector_results": vector_results,
+            "mode": mode,
         }
         return combined_results
 
@@ -0,0 +1,207 @@
+import heapq
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Callable, List, Union
+
+import numpy as np
+
+
+def top_k_indices(scores, top_k: int, descending: bool = True) -> List[int]:
+    """
+    Return the indices of the top_k scores, ordered by score and then by index.
+    Ties are always broken by the lower index so that sharded and unsharded
+    searches return identical rankings.
+    :param scores: 1-D array of scores.
+    :param top_k: Number of indices to return.
+    :param descending: True for similarity scores, False for distances.
+    """
+    scores = np.asarray(scores)
+    if top_k <= 0 or scores.size == 0:
+        return []
+
+    keys = -scores if descending else scores
+    if top_k < keys.size:
+        # Keep every candidate tied with the k-th value so the tie-break below stays exact
+        threshold = np.partition(keys, top_k - 1)[top_k - 1]
+        candidates = np.flatnonzero(keys <= threshold)
+    else:
+        candidates = np.arange(keys.size)
+
+    order = np.lexsort((candidates, keys[candidates]))
+    return candidates[order][:top_k].tolist()
+
+
+def assign_shards(chunks: List[str], num_shards: int, assignment: Union[str, Callable] = "round_robin") -> List[int]:
+    """
+    Map each chunk to a shard number.
+    :param chunks: Chunk file names, in corpus order.
+    :param num_shards: Number of shards.
+    :param assignment: "round_robin", "hash" (stable across restarts and corpus growth),
+                       or a callable taking (position, chunk_file) and returning a shard number.
+    :return: Shard number for every chunk.
+    """
+    if assignment == "round_robin":
+        return [i % num_shards for i in range(len(chunks))]
+    if assignment == "hash":
+        return [zlib.crc32(chunk.encode("utf-8")) % num_shards for chunk in chunks]
+    if callable(assignment):
+        return [assignment(i, chunk) % num_shards for i, chunk in enumerate(chunks)]
+    raise ValueError(f"Unknown shard assignment: {assignment}")
+
+
+class RetrievalShard:
+    def __init__(self, shard_id: int, positions: List[int], chunk_matrix, embeddings=None):
+        """
+        A partition of the chunk corpus with its own BM25 matrix and local vector index.
+        :param shard_id: Shard number.
+        :param positions: Global corpus positions of the chunks held by this shard.
+        :param chunk_matrix: BM25 (TF-IDF) matrix of the shard's chunks, one row per position.
+        :param embeddings: Optional array of the shard's chunk embeddings, one row per position.
+        """
+        self.shard_id = shard_id
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.chunk_matrix = chunk_matrix
+        self.embeddings = None if embeddings is None else np.asarray(embeddings, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def bm25_search(self, query_vector, top_k: int = 5) -> List[tuple]:
+        """
+        Score the shard's chunks against a transformed query.
+        :return: (score, global position) pairs, best first.
+        """
+        if len(self) == 0:
+            return []
+        scores = (self.chunk_matrix @ query_vector.T).toarray().flatten()
+        return [(float(scores[i]), int(self.positions[i])) for i in top_k_indices(scores, top_k)]
+
+    def vector_search(self, query_embedding, top_k: int = 5) -> List[tuple]:
+        """
+        Exact L2 search over the shard's embeddings (squared distance, as reported by Milvus).
+        :return: (distance, global position) pairs, nearest first.
+        """
+        if self.embeddings is None or len(self) == 0:
+            return []
+        diff = self.embeddings - np.asarray(query_embedding, dtype=np.float32)
+        distances = np.einsum("ij,ij->i", diff, diff)
+        return [(float(distances[i]), int(self.positions[i])) for i in top_k_indices(distances, top_k, descending=False)]
+
+
+def merge_top_k(shard_results: List[List[tuple]], top_k: int, descending: bool = True) -> List[tuple]:
+    """
+    Heap-merge per-shard ranked (score, position) lists into a global top_k.
+    """
+    if descending:
+        key = lambda item: (-item[0], item[1])
+    else:
+        key = lambda item: (item[0], item[1])
+    return list(islice(heapq.merge(*shard_results, key=key), top_k))
+
+
+# The one shard held by a process-pool worker, installed once by the pool initializer
+_worker_shard: RetrievalShard = None
+
+
+def _watch_parent(parent_pid: int, interval: float = 1.0):
+    # A worker blocked on the task queue never notices its server dying; exit once reparented
+    while os.getppid() == parent_pid:
+        time.sleep(interval)
+    os._exit(0)
+
+
+def _init_worker(shard: RetrievalShard, parent_pid: int):
+    global _worker_shard
+    _worker_shard = shard
+    # Don't keep handlers inherited from the server (e.g. uvicorn's), so workers die with a plain SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    threading.Thread(target=_watch_parent, args=(parent_pid,), daemon=True, name="parent-watch").start()
+
+
+def _worker_ready() -> int:
+    return len(_worker_shard)
+
+
+def _search_worker_shard(method: str, query, top_k: int):
+    return getattr(_worker_shard, method)(query, top_k)
+
+
+class ShardedIndex:
+    def __init__(self, shards: List[RetrievalShard], executor: str = "thread", max_workers: int = None):
+        """
+        Fan queries out to every shard in parallel and merge the per-shard top-k lists.
+        :param shards: The corpus partitions.
+        :param executor: "thread" or "process". In process mode every shard gets its own single-worker
+                         pool holding only that shard, so the corpus is kept in memory once.
+        :param max_workers: Thread pool size; defaults to one worker per shard. Process mode always
+                            runs one worker per shard and raises ValueError if it is given.
+        """
+        self.executor_type = executor
+        self.num_shards = len(shards)
+
+        if executor == "thread":
+            self.shards = shards
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers or len(shards), thread_name_prefix="retrieval-shard"
+            )
+        elif executor == "process":
+            if max_workers is not None:
+                raise ValueError(
+                    "max_workers only applies to the thread executor; process mode runs one worker per shard"
+                )
+            self.shards = None  # Held by the workers only
+            # Spawned rather than forked, so workers don't inherit the server's threads, sockets or handlers
+            context = multiprocessing.get_context("spawn")
+            self.executors = [
+                ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                    initargs=(shard, os.getpid()))
+                for shard in shards
+            ]
+            # Start the workers now instead of on the first query
+            for future in [executor.submit(_worker_ready) for executor in self.executors]:
+                future.result()
+        else:
+            raise ValueError(f"Unknown shard executor: {executor}")
+
+    def _fan_out(self, method: str, query, top_k: int, timeout: float = None) -> List[List[tuple]]:
+        if self.executor_type == "thread":
+            futures = [self.executor.submit(getattr(shard, method), query, top_k) for shard in self.shards]
+        else:
+            futures = [
+                executor.submit(_search_worker_shard, method, query, top_k) for executor in self.executors
+            ]
+
+        _, pending = wait(futures, timeout=timeout)
+        if pending:
+            for future in pending:
+                future.cancel()
+            raise TimeoutError(f"{len(pending)} of {len(futures)} shards did not finish {method} within {timeout:.3f}s")
+        return [future.result() for future in futures]
+
+    def bm25_search(self, query_vector, top_k: int = 5, timeout: float = None) -> List[tuple]:
+        """
+        Global BM25 top_k as (score, global position) pairs.
+        Raises TimeoutError if any shard has not answered within timeout seconds.
+        """
+        return merge_top_k(self._fan_out("bm25_search", query_vector, top_k, timeout), top_k)
+
+    def vector_search(self, query_embedding, top_k: int = 5, timeout: float = None) -> List[tuple]:
+        """
+        Global nearest neighbours as (distance, global position) pairs, by exact L2 search.
+        Raises TimeoutError if any shard has not answered within timeout seconds.
+        """
+        return merge_top_k(self._fan_out("vector_search", query_embedding, top_k, timeout), top_k, descending=False)
+
+    def shutdown(self):
+        if self.executor_type == "thread":
+            self.executor.shutdown(wait=True)
+        else:
+            for executor in self.executors:
+                executor.shutdown(wait=True)
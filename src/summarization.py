@@ -18,12 +18,13 @@ class GeminiSummarizer:
         if not self.api_key:
             raise ValueError("Gemini API key is not set. Please add it to the .env file.")
 
-    def summarize(self, chunks, query: str, prompt="Summarize the following text:"):
+    def summarize(self, chunks, query: str, prompt="Summarize the following text:", timeout=None):
         """
         Summarize the retrieved chunks using the Gemini API.
         :param chunks: List of retrieved text chunks.
         :param query: The original user query.
         :param prompt: Instruction for summarization (optional).
+        :param timeout: Optional request timeout in seconds.
         :return: Summarized response as a string.
         """
         # Combine the retrieved chunks into a single context
@@ -40,9 +41,13 @@ class GeminiSummarizer:
         final_prompt = f"{default_prompt}\n\nQuery: {query}\n\n{prompt}\n\n{context}"
 
         # Call the Gemini API to generate the summary
+        config = None
+        if timeout is not None:
+            config = {"http_options": {"timeout": max(1, int(timeout * 1000))}}  # Milliseconds
+
         try:
             response = self.client.models.generate_content(
-                model=self.model, contents=[final_prompt]
+                model=self.model, contents=[final_prompt], config=config
             )
             return response.text
         except Exception as e: